@@ -3,9 +3,19 @@ import os
 import shlex
 import subprocess
 import sys
+import tempfile
 import time
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
+# Downloads are checked with the plugin's subscription parser, the plugin
+# root is three levels up from clash/profiles/download_server.py
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+import yaml  # noqa: E402
+
+from py_modules.subconv import detect_format  # noqa: E402
+
 HTML_TEMPLATE = """
 <html>
 <head>
@@ -66,7 +76,7 @@ FORM_TEMPLATE = """
             <input type="hidden" name="action" value="download">
             <label for="d-name">Profile Name:</label>
             <input type="text" id="d-name" name="name" value="{download_profile_name}">
-            <label for="d-url">URL:</label>
+            <label for="d-url">URL (separate mirrors with spaces):</label>
             <input type="text" id="d-url" name="url" value="{download_url}">
             <label for="d-interval">Update Interval (hours):</label>
             <input type="number" id="d-interval" name="interval" value="{download_interval}" min="0">
@@ -87,8 +97,17 @@ FORM_TEMPLATE = """
     </div>
 """
 
+# curl limits for profile downloads
+CONNECT_TIMEOUT = 10
+MAX_TIME = 120
+MAX_SIZE = 16 * 1024 * 1024
+
 
 class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
+    @property
+    def profiles_dir(self):
+        # Set by the plugin when it serves in-process, else the working directory
+        return getattr(self.server, "profiles_dir", os.getcwd())
 
     def do_GET(self):
         self.send_response(200)
@@ -104,7 +123,7 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         )
         html = (
             HTML_TEMPLATE.replace("{FORM_TEMPLATE}", form)
-            .replace("{CWD}", f"<p>Current working directory: {os.getcwd()}</p>")
+            .replace("{CWD}", f"<p>Profiles directory: {self.profiles_dir}</p>")
             .replace("{active_tab}", "Download")
         )
         self.wfile.write(html.encode("utf-8"))
@@ -131,28 +150,67 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         url = form.getvalue("url")
         interval = form.getvalue("interval", "0")
 
-        safe_url = shlex.quote(url)
-        filename = shlex.quote(profile_name + ".yml")
-        command = f"curl -L {safe_url} -o {filename}"
+        urls = url.split()
+        filename = os.path.join(self.profiles_dir, profile_name + ".yml")
 
         try:
-            subprocess.run(command, shell=True, check=True)
+            if not urls:
+                raise ValueError("No URL given")
+            update_interval = int(interval)
+            # Try each mirror in turn, a stalled one is abandoned by curl.
+            # Bodies land in a temporary file and only replace the profile
+            # once they are complete and in a format the plugin can load.
+            errors = []
+            for mirror in urls:
+                fd, temp_path = tempfile.mkstemp(suffix=".part", dir=self.profiles_dir)
+                os.close(fd)
+                command = (
+                    f"curl -fL --connect-timeout {CONNECT_TIMEOUT} "
+                    f"--max-time {MAX_TIME} --max-filesize {MAX_SIZE} "
+                    f"{shlex.quote(mirror)} -o {shlex.quote(temp_path)}"
+                )
+                try:
+                    subprocess.run(command, shell=True, check=True)
+                    with open(temp_path, "r", encoding="utf-8") as file:
+                        subscription_format = detect_format(file.read())
+                    if subscription_format is None:
+                        raise ValueError("Unrecognised subscription format")
+                    os.replace(temp_path, filename)
+                    break
+                except (subprocess.CalledProcessError, ValueError) as e:
+                    errors.append(f"{mirror}: {e}")
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+            else:
+                raise RuntimeError("All mirrors failed: " + "; ".join(errors))
             response_message = "File downloaded successfully."
             update_time = int(time.time())
-            meta_filename = profile_name + ".meta.yml"
+            meta_filename = os.path.join(
+                self.profiles_dir, profile_name + ".meta.yml"
+            )
+            # Keep per-profile options such as steam_direct and mirror_latency
+            meta = {}
+            if os.path.exists(meta_filename):
+                with open(meta_filename, "r") as meta_file:
+                    meta = yaml.safe_load(meta_file) or {}
+            meta.update(
+                {
+                    "type": "download",
+                    "url": urls[0],
+                    "urls": urls,
+                    "format": subscription_format,
+                    "update_time": update_time,
+                    "update_interval": update_interval,
+                }
+            )
             with open(meta_filename, "w") as meta_file:
-                meta_file.write("type: download\n")
-                meta_file.write(f"url: {url}\n")
-                meta_file.write(f"update_time: {update_time}\n")
-                meta_file.write(f"update_interval: {interval}\n")
-        except subprocess.CalledProcessError as e:
+                yaml.dump(meta, meta_file)
+        except RuntimeError as e:
+            # The previous profile, if any, is left in place
             response_message = f"Error downloading file: {e}"
-            if os.path.exists(filename):
-                os.remove(filename)
         except Exception as e:
             response_message = f"An unexpected error occurred: {str(e)}"
-            if os.path.exists(filename):
-                os.remove(filename)
 
         self.send_response(200)
         self.send_header("Content-type", "text/html")
@@ -167,7 +225,7 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         )
         html = (
             HTML_TEMPLATE.replace("{FORM_TEMPLATE}", form_template)
-            .replace("{CWD}", f"<p>Current working directory: {os.getcwd()}</p>")
+            .replace("{CWD}", f"<p>Profiles directory: {self.profiles_dir}</p>")
             .replace("{active_tab}", "Download")
         )
         self.wfile.write(html.encode("utf-8"))
@@ -178,12 +236,14 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
 
         if file_item.filename and file_item.filename.endswith(".yml"):
             try:
-                filename = profile_name + ".yml"
+                filename = os.path.join(self.profiles_dir, profile_name + ".yml")
                 with open(filename, "wb") as file_out:
                     file_out.write(file_item.file.read())
                 response_message = "File uploaded successfully."
                 update_time = int(time.time())
-                meta_filename = profile_name + ".meta.yml"
+                meta_filename = os.path.join(
+                    self.profiles_dir, profile_name + ".meta.yml"
+                )
                 with open(meta_filename, "w") as meta_file:
                     meta_file.write("type: upload\n")
                     meta_file.write(f"update_time: {update_time}\n")
@@ -208,7 +268,7 @@ class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
         )
         html = (
             HTML_TEMPLATE.replace("{FORM_TEMPLATE}", form_template)
-            .replace("{CWD}", f"<p>Current working directory: {os.getcwd()}</p>")
+            .replace("{CWD}", f"<p>Profiles directory: {self.profiles_dir}</p>")
             .replace("{active_tab}", "Upload")
         )
         self.wfile.write(html.encode("utf-8"))
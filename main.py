@@ -1,14 +1,14 @@
+import asyncio
 import os
-import shlex
+import re
+import shutil
 import ssl
-import subprocess
 import sys
 import tempfile
 import time
 import traceback
 import uuid
 
-import aiohttp
 import certifi
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -19,6 +19,8 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import decky_plugin
 from settings import SettingsManager
 
+from py_modules.core_logs import CoreLogStream
+from py_modules.downloader import hedged_download, order_mirrors
 from py_modules.func import (
     check_if_service_exists,
     check_resolved_state,
@@ -27,7 +29,7 @@ from py_modules.func import (
     copy_folder,
     disable_systemd_resolved,
     get_profile_meta,
-    kill_process_on_port,
+    is_profile_file,
     list_profiles,
     restore_systemd_resolved,
     run_command,
@@ -35,8 +37,56 @@ from py_modules.func import (
     update_config_file,
     wrap_return,
 )
-
-server_process = None
+from py_modules.profile_server import ProfileServer, release_stale_owner
+from py_modules.profile_store import load_history, restore_version, save_version
+from py_modules.readiness import (
+    load_readiness_history,
+    record_readiness,
+    wait_until_ready,
+)
+from py_modules.rule_engine import load_engine
+
+profile_server = None
+core_log_stream = None
+
+
+class StateStore:
+    """
+    Versioned snapshot of the state the panel renders. Every change bumps the
+    version, so the frontend polls for the keys changed since the version it
+    last saw instead of re-querying everything. Versions restart with the
+    backend, the epoch tells the frontend which run they belong to.
+    """
+
+    def __init__(self):
+        self.epoch = str(uuid.uuid4())
+        self.version = 0
+        self.values = {}
+        self.versions = {}
+
+    def set(self, key, value):
+        if key in self.values and self.values[key] == value:
+            return
+        self.version += 1
+        self.values[key] = value
+        self.versions[key] = self.version
+
+    def since(self, version, epoch=None):
+        # A version from before a backend reload gets the full state
+        if epoch != self.epoch:
+            version = 0
+        return {
+            "epoch": self.epoch,
+            "version": self.version,
+            "changes": {
+                key: self.values[key]
+                for key, key_version in self.versions.items()
+                if key_version > version
+            },
+        }
+
+
+state = StateStore()
 
 
 class Plugin:
@@ -49,20 +99,58 @@ class Plugin:
         return wrap_return(self.VERSION)
 
     async def check_services(self):
+        return wrap_return(await Plugin._refresh_services(self))
+
+    async def _refresh_services(self):
         tunup = check_service_status("tunup")
         await Plugin.log_py(self, tunup.pop("debug", None))
         resolved = check_service_status("systemd-resolved")
         await Plugin.log_py(self, resolved.pop("debug", None))
-        return wrap_return(
-            {
-                "tunup": {"exists": check_if_service_exists("tunup"), **tunup},
-                "resolved": {
-                    "exists": check_if_service_exists("systemd-resolved"),
-                    **resolved,
+        services = {
+            "tunup": {"exists": check_if_service_exists("tunup"), **tunup},
+            "resolved": {
+                "exists": check_if_service_exists("systemd-resolved"),
+                **resolved,
+            },
+        }
+        state.set("services", services)
+        return services
+
+    async def _refresh_profiles(self):
+        profiles = list_profiles(
+            os.path.join(os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles")
+        )
+        state.set("profiles", sorted(profiles))
+        cur_profile = await Plugin.get_settings(self, "profile", "", string=False)
+        state.set("profile", cur_profile)
+        profile_meta = get_profile_meta(cur_profile) if cur_profile else None
+        if profile_meta is not None:
+            state.set(
+                "profile_meta",
+                {
+                    "type": profile_meta["type"],
+                    "update_time": profile_meta["update_time"],
+                    "steam_direct": profile_meta.get("steam_direct", False),
                 },
-            }
+            )
+
+    def _set_refresh(self, profile_name, stage):
+        state.set(
+            "refresh",
+            {"profile": profile_name, "stage": stage, "time": int(time.time())},
         )
 
+    async def get_state_since(self, version=0, epoch=None):
+        """
+        Return the state keys changed after `version`, or the whole state when
+        `epoch` is from another backend run. It answers at once: decky runs
+        one call of a plugin at a time, so waiting here would hold up every
+        other call.
+        """
+        if "services" not in state.values:
+            await Plugin._refresh_services(self)
+        return wrap_return(state.since(version, epoch))
+
     async def check_resolved(self):
         return wrap_return(check_resolved_state())
 
@@ -73,6 +161,8 @@ class Plugin:
             await Plugin.log_py_err(self, f"Error: {e}")
             await Plugin.log_py_err(self, traceback.format_exc())
             return wrap_return(False)
+        finally:
+            await Plugin._refresh_services(self)
         return wrap_return(True)
 
     async def disable_resolved(self):
@@ -82,14 +172,16 @@ class Plugin:
             await Plugin.log_py_err(self, f"Error: {e}")
             await Plugin.log_py_err(self, traceback.format_exc())
             return wrap_return(False)
+        finally:
+            await Plugin._refresh_services(self)
         return wrap_return(True)
 
     async def get_profiles(self):
-        return wrap_return(
-            list_profiles(
-                os.path.join(os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles")
-            )
+        profiles = list_profiles(
+            os.path.join(os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles")
         )
+        state.set("profiles", sorted(profiles))
+        return wrap_return(profiles)
 
     async def get_profile_meta(self, profile_name):
         ret = get_profile_meta(profile_name)
@@ -99,44 +191,160 @@ class Plugin:
             {
                 "type": ret["type"],
                 "update_time": ret["update_time"],
+                "steam_direct": ret.get("steam_direct", False),
             }
         )
 
+    async def set_steam_direct(self, profile_name, enabled):
+        profile_meta = get_profile_meta(profile_name)
+        if profile_meta is None:
+            return wrap_return(False)
+        previous = profile_meta.get("steam_direct", False)
+        profile_meta["steam_direct"] = enabled
+        set_profile_meta(profile_name, profile_meta)
+        cur_profile = await Plugin.get_settings(self, "profile", "", string=False)
+        # Rebuild even when tunup is stopped, so the next start uses the new rules
+        if profile_name == cur_profile:
+            try:
+                ret = update_config_file(
+                    profile_name,
+                    os.path.dirname(os.path.realpath(__file__)),
+                    decky_plugin.logger,
+                )
+            except Exception as e:
+                await Plugin.log_py_err(self, f"Error: {e}")
+                await Plugin.log_py_err(self, traceback.format_exc())
+                profile_meta["steam_direct"] = previous
+                set_profile_meta(profile_name, profile_meta)
+                await Plugin._refresh_profiles(self)
+                return wrap_return(False)
+            await Plugin._save_version(self, profile_name, ret)
+            if check_service_status("tunup")["active"]:
+                ret = run_command(["systemctl", "restart", "tunup"])
+                await Plugin.log_py(self, "Restart tunup: " + str(ret))
+        await Plugin._refresh_profiles(self)
+        return wrap_return(True)
+
+    async def get_core_logs(self, offset=0, limit=50, level=None, pattern=None):
+        if core_log_stream is None:
+            return wrap_return(False)
+        try:
+            return wrap_return(core_log_stream.query(offset, limit, level, pattern))
+        except re.error as e:
+            await Plugin.log_py_err(self, f"Invalid log pattern: {e}")
+            return wrap_return(False)
+
+    async def set_core_log_filter(self, level=None, pattern=None):
+        if core_log_stream is None:
+            return wrap_return(False)
+        try:
+            core_log_stream.set_filter(level, pattern)
+        except re.error as e:
+            await Plugin.log_py_err(self, f"Invalid log pattern: {e}")
+            return wrap_return(False)
+        if level is not None:
+            await Plugin.set_settings(self, "core_log.level", level)
+        if pattern is not None:
+            await Plugin.set_settings(self, "core_log.pattern", pattern)
+        await Plugin.commit_settings(self)
+        return wrap_return(True)
+
+    async def _load_engine(self):
+        config_yml_path = os.path.join("/home/deck/.config", "tunup", "config.yml")
+        try:
+            return load_engine(config_yml_path)
+        except Exception as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+            await Plugin.log_py_err(self, traceback.format_exc())
+            return None
+
+    async def match_rule(self, host):
+        engine = await Plugin._load_engine(self)
+        if engine is None:
+            return wrap_return(False)
+        return wrap_return(engine.match(host))
+
+    async def match_rules(self, hosts):
+        engine = await Plugin._load_engine(self)
+        if engine is None:
+            return wrap_return(False)
+        return wrap_return(engine.match_many(hosts))
+
+    async def audit_rules(self):
+        engine = await Plugin._load_engine(self)
+        if engine is None:
+            return wrap_return(False)
+        return wrap_return(engine.audit())
+
     async def check_server(self):
         await Plugin.log_py(self, "Checking server")
-        global server_process
-        if server_process is None:
+        if profile_server is None or not profile_server.running:
             await Plugin.log_py(self, "Server is not running.")
             return wrap_return(False)
         await Plugin.log_py(self, "Server is running.")
         return wrap_return(True)
 
-    async def update_profile(self, profile_name):
-        profile_meta = get_profile_meta(profile_name)
-        if profile_meta is None:
+    async def create_merged_profile(self, profile_name, profiles, rules_profile):
+        if profile_name in profiles:
+            await Plugin.log_py(self, "A merged profile can not include itself")
             return wrap_return(False)
-        profile_type = profile_meta["type"]
-        if profile_type == "upload":
-            await Plugin.log_py(self, "Profile is of type upload")
+        existing = list_profiles(
+            os.path.join(os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles")
+        )
+        if profile_name in existing:
+            await Plugin.log_py(self, f"Profile {profile_name} already exists")
+            return wrap_return(False)
+        if rules_profile not in profiles:
+            await Plugin.log_py(self, "Rules profile must be one of the merged profiles")
             return wrap_return(False)
-        # Download profile
-        url = profile_meta["url"]
-        update_interval = profile_meta["update_interval"]
-        # use aiohttp to temp dir then move to profiles
+        for name in profiles:
+            profile_meta = get_profile_meta(name)
+            if profile_meta is None or profile_meta["type"] == "merge":
+                await Plugin.log_py(self, f"Profile {name} can not be merged")
+                return wrap_return(False)
+        set_profile_meta(
+            profile_name,
+            {
+                "type": "merge",
+                "profiles": profiles,
+                "rules_profile": rules_profile,
+                "update_time": int(time.time()),
+                "update_interval": 0,
+            },
+        )
+        await Plugin._refresh_profiles(self)
+        return wrap_return(True)
+
+    async def _download_profile(self, profile_name, profile_meta):
+        # Download profile, racing the mirrors fastest first
+        urls = profile_meta.get("urls") or [profile_meta["url"]]
+        # Drop timings of mirrors that were removed from the meta
+        latencies = {
+            url: latency
+            for url, latency in (profile_meta.get("mirror_latency") or {}).items()
+            if url in urls
+        }
+        urls = order_mirrors(urls, latencies)
         profiles_savepath = os.path.join(
             os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles"
         )
+        temp_dir = tempfile.mkdtemp()
+        # Format of each body, detected once while validating it
+        formats = {}
+
+        def validate(path):
+            formats[path] = is_profile_file(path)
+            return formats[path] is not None
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, ssl=self.ssl_context) as res:
-                    res.raise_for_status()
-                    with tempfile.NamedTemporaryFile(
-                        suffix=".yml", delete=False
-                    ) as temp_file:
-                        filename = shlex.quote(temp_file.name)
-                        with open(temp_file.name, "wb") as file:
-                            async for chunk in res.content.iter_chunked(1024):
-                                file.write(chunk)
+            url, filename = await hedged_download(
+                urls,
+                temp_dir,
+                self.ssl_context,
+                validate=validate,
+                latencies=latencies,
+            )
+            await Plugin.log_py(self, f"Downloaded {profile_name} from {url}")
             # Move to profiles
             copy_file(
                 filename,
@@ -145,23 +353,126 @@ class Plugin:
                     f"{profile_name}.yml",
                 ),
             )
-            update_time = int(time.time())
-            meta_filename = os.path.join(
-                profiles_savepath,
-                f"{profile_name}.meta.yml",
+            profile_meta["update_time"] = int(time.time())
+            profile_meta["format"] = formats[filename]
+        except Exception as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+            await Plugin.log_py_err(self, traceback.format_exc())
+            return False
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            # Keep per-profile options such as steam_direct
+            profile_meta["mirror_latency"] = latencies
+            set_profile_meta(profile_name, profile_meta)
+        return True
+
+    async def update_profile(self, profile_name):
+        profile_meta = get_profile_meta(profile_name)
+        if profile_meta is None:
+            return wrap_return(False)
+        profile_type = profile_meta["type"]
+        if profile_type == "upload":
+            await Plugin.log_py(self, "Profile is of type upload")
+            return wrap_return(False)
+        Plugin._set_refresh(self, profile_name, "downloading")
+        if profile_type == "merge":
+            # Refresh every downloaded member, then rebuild the merged config
+            for name in profile_meta["profiles"]:
+                member_meta = get_profile_meta(name)
+                if member_meta is None or member_meta["type"] != "download":
+                    continue
+                if not await Plugin._download_profile(self, name, member_meta):
+                    Plugin._set_refresh(self, profile_name, "failed")
+                    return wrap_return(False)
+            profile_meta["update_time"] = int(time.time())
+            set_profile_meta(profile_name, profile_meta)
+        elif not await Plugin._download_profile(self, profile_name, profile_meta):
+            Plugin._set_refresh(self, profile_name, "failed")
+            return wrap_return(False)
+        Plugin._set_refresh(self, profile_name, "building")
+        try:
+            ret = update_config_file(
+                profile_name,
+                os.path.dirname(os.path.realpath(__file__)),
+                decky_plugin.logger,
             )
-            with open(meta_filename, "w") as meta_file:
-                meta_file.write(f"url: {url}\n")
-                meta_file.write(f"update_time: {update_time}\n")
-                meta_file.write(f"update_interval: {update_interval}\n")
-                meta_file.write("type: download\n")
         except Exception as e:
             await Plugin.log_py_err(self, f"Error: {e}")
             await Plugin.log_py_err(self, traceback.format_exc())
+            Plugin._set_refresh(self, profile_name, "failed")
             return wrap_return(False)
-        update_config_file(profile_name, os.path.dirname(os.path.realpath(__file__)))
+        await Plugin._save_version(self, profile_name, ret)
+        Plugin._set_refresh(self, profile_name, "restarting")
         ret = run_command(["systemctl", "restart", "tunup"])
         await Plugin.log_py(self, "Restart tunup: " + str(ret))
+        readiness = None
+        # Nothing to wait for when the service is not installed
+        if ret[2] == 0:
+            Plugin._set_refresh(self, profile_name, "waiting")
+            readiness = await Plugin._wait_ready(self, "update_profile")
+        Plugin._set_refresh(self, profile_name, "done")
+        await Plugin._refresh_profiles(self)
+        await Plugin._refresh_services(self)
+        return wrap_return({"updated": True, "readiness": readiness})
+
+    async def _save_version(self, profile_name, config_ret):
+        # Merged profiles have no content of their own, their members are
+        # versioned when they are built on their own
+        if (get_profile_meta(profile_name) or {}).get("type") == "merge":
+            return
+        profile_yml_path, _, config_yml_path = config_ret
+        keep = await Plugin.get_settings(self, "history.size", 5, string=False)
+        try:
+            version = save_version(
+                profile_name, profile_yml_path, config_yml_path, keep
+            )
+        except Exception as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+            await Plugin.log_py_err(self, traceback.format_exc())
+            return
+        await Plugin.log_py(self, f"Saved {profile_name} version {version}")
+
+    async def get_profile_history(self, profile_name):
+        if (get_profile_meta(profile_name) or {}).get("type") == "merge":
+            return wrap_return([])
+        return wrap_return(load_history(profile_name))
+
+    async def rollback_profile(self, profile_name, version):
+        """
+        Restore a stored version of a profile. Merged profiles can not be
+        rolled back, they are rebuilt from their members on every change, so
+        roll back a member profile instead.
+        """
+        profile_meta = get_profile_meta(profile_name)
+        if profile_meta is None:
+            return wrap_return(False)
+        if profile_meta["type"] == "merge":
+            await Plugin.log_py(
+                self, "Merged profiles can not be rolled back, roll back a member"
+            )
+            return wrap_return(False)
+        profile_yml_path = os.path.join(
+            os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles", f"{profile_name}.yml"
+        )
+        cur_profile = await Plugin.get_settings(self, "profile", "", string=False)
+        is_current = profile_name == cur_profile
+        # The running config is only swapped for the active profile
+        config_yml_path = (
+            os.path.join("/home/deck/.config", "tunup", "config.yml")
+            if is_current
+            else None
+        )
+        try:
+            restore_version(profile_name, version, profile_yml_path, config_yml_path)
+        except Exception as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+            await Plugin.log_py_err(self, traceback.format_exc())
+            return wrap_return(False)
+        await Plugin.log_py(self, f"Rolled back {profile_name} to {version}")
+        if is_current and check_service_status("tunup")["active"]:
+            ret = run_command(["systemctl", "restart", "tunup"])
+            await Plugin.log_py(self, "Restart tunup: " + str(ret))
+        await Plugin._refresh_profiles(self)
         return wrap_return(True)
 
     async def install_service(self):
@@ -196,8 +507,9 @@ class Plugin:
             os.path.join(tunup_path, "web"),
         )
         await Plugin.log_py(self, f"Current profile: {cur_profile}")
-        ret = update_config_file(cur_profile, dir_path)
+        ret = update_config_file(cur_profile, dir_path, decky_plugin.logger)
         await Plugin.log_py(self, "Update config file: " + str(ret))
+        await Plugin._save_version(self, cur_profile, ret)
 
         ret = run_command(
             [
@@ -214,28 +526,55 @@ class Plugin:
         await Plugin.log_py(self, "Enable service: " + str(ret))
         ret = run_command(["systemctl", "restart", "tunup"])
         await Plugin.log_py(self, "Restart tunup: " + str(ret))
-        return wrap_return(str(ret))
+        readiness = None
+        if ret[2] == 0:
+            readiness = await Plugin._wait_ready(self, "install_service")
+        await Plugin._refresh_services(self)
+        return wrap_return({"restart": str(ret), "readiness": readiness})
+
+    async def _wait_ready(self, reason):
+        """Wait for the restarted core to carry traffic and record how long it took."""
+        deadline = await Plugin.get_settings(
+            self, "readiness.deadline", 30, string=False
+        )
+        readiness = await wait_until_ready(deadline)
+        await Plugin.log_py(self, f"Readiness after {reason}: {readiness}")
+        try:
+            record_readiness(readiness, reason)
+        except Exception as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+        state.set("readiness", readiness)
+        return readiness
+
+    async def get_readiness_history(self):
+        return wrap_return(load_readiness_history())
 
     async def uninstall_service(self):
         _, _, _ = run_command(["systemctl", "stop", "tunup"])
         _, _, _ = run_command(["systemctl", "disable", "tunup"])
+        await Plugin._refresh_services(self)
         return wrap_return(True)
 
     async def start_service(self, service):
         _, _, code = run_command(["systemctl", "start", service])
-        return wrap_return(code)
+        readiness = None
+        if service == "tunup" and code == 0:
+            readiness = await Plugin._wait_ready(self, "start_service")
+        await Plugin._refresh_services(self)
+        return wrap_return({"code": code, "readiness": readiness})
 
     async def stop_service(self, service):
         _, _, code = run_command(["systemctl", "stop", service])
+        await Plugin._refresh_services(self)
         return wrap_return(code)
 
     async def check_if_service_exists(self, service):
         return wrap_return(check_if_service_exists(service))
 
     async def start_server(self):
-        """Start the server process"""
-        global server_process
-        if server_process is not None:
+        """Bind the profile server port, requests are served once they arrive"""
+        global profile_server
+        if profile_server is not None and profile_server.running:
             await Plugin.log_py(self, "Server is already running.")
             return wrap_return(True)
         # Get the directory of the current script
@@ -247,30 +586,39 @@ class Plugin:
         if not os.path.exists(profiles_savepath):
             # Create the directory if it does not exist
             os.makedirs(profiles_savepath, exist_ok=True)
-        server_process = subprocess.Popen(
-            ["python", f"{profiles_path}/download_server.py"], cwd=profiles_savepath
+        idle_timeout = await Plugin.get_settings(
+            self, "server.idle_timeout", 600, string=False
+        )
+        profile_server = ProfileServer(
+            os.path.join(profiles_path, "download_server.py"),
+            profiles_savepath,
+            idle_timeout=idle_timeout,
+            # Profiles may have been added or replaced through the server
+            on_request=lambda: asyncio.ensure_future(Plugin._refresh_profiles(self)),
+            on_stop=lambda: state.set("server", False),
+            logger=decky_plugin.logger,
         )
+        try:
+            profile_server.start()
+        except OSError as e:
+            await Plugin.log_py_err(self, f"Error: {e}")
+            return wrap_return(False)
         await Plugin.log_py(self, "Server started.")
+        state.set("server", True)
         return wrap_return(True)
 
     async def stop_server(self):
-        """Stop the server process"""
+        """Stop the profile server and release its port"""
         await Plugin.log_py(self, "Stopping server.")
-        global server_process
-        if server_process is None:
+        if profile_server is None or not profile_server.running:
             await Plugin.log_py(self, "Server is not running.")
-            if kill_process_on_port(12345):
-                await Plugin.log_py(self, "Killed another process using port 12345.")
+            if release_stale_owner():
+                await Plugin.log_py(self, "Terminated a stale server process.")
+            state.set("server", False)
             return wrap_return(True)
-        await Plugin.log_py(self, f"Terminating server process: {server_process.pid}")
-        server_process.terminate()  # Send termination signal
-        try:
-            server_process.wait(3)  # Wait for the process to finish
-        except subprocess.TimeoutExpired:
-            await Plugin.log_py(self, "Server process did not terminate.")
-            server_process.kill()
+        await profile_server.stop()
         await Plugin.log_py(self, "Server stopped.")
-        server_process = None
+        await Plugin._refresh_profiles(self)
         return wrap_return(True)
 
     async def log(self, message):
@@ -300,6 +648,11 @@ class Plugin:
 
     async def commit_settings(self):
         self.settingsManager.commit()
+        # The active profile is part of the panel state
+        if self.settingsManager.getSetting("profile", "") != state.values.get(
+            "profile"
+        ):
+            await Plugin._refresh_profiles(self)
 
     async def get_token(self):
         self.TOKEN = str(uuid.uuid4())[:6]
@@ -315,11 +668,28 @@ class Plugin:
     async def _main(self):
         decky_plugin.logger.info(f"TunUp {self.VERSION} backend loaded.")
         self.TOKEN = None
+        global core_log_stream
+        core_log_stream = CoreLogStream(
+            size=await Plugin.get_settings(self, "core_log.size", 500, string=False),
+            level=await Plugin.get_settings(
+                self, "core_log.level", "info", string=False
+            ),
+            pattern=await Plugin.get_settings(
+                self, "core_log.pattern", "", string=False
+            ),
+            logger=decky_plugin.logger,
+        )
+        core_log_stream.start()
+        state.set("version", self.VERSION)
+        state.set("server", profile_server is not None and profile_server.running)
+        await Plugin._refresh_profiles(self)
 
     # Function called first during the unload process, utilize this to handle your plugin being removed
     async def _unload(self):
-        if server_process is not None:
-            Plugin.stop_server(self)
+        if profile_server is not None:
+            await profile_server.stop()
+        if core_log_stream is not None:
+            core_log_stream.stop()
         decky_plugin.logger.info("TunUp backend unloaded.")
 
     # Migrations that should be performed before entering `_main()`.
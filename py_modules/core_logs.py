@@ -0,0 +1,148 @@
+import asyncio
+import json
+import re
+import time
+from collections import deque
+
+import aiohttp
+
+CONTROLLER_URL = "http://127.0.0.1:9090"
+
+# Clash log levels ordered from most to least verbose
+LOG_LEVELS = ["debug", "info", "warning", "error"]
+
+
+def level_rank(level):
+    """Return the position of a clash log level, unknown levels rank as info."""
+    try:
+        return LOG_LEVELS.index(level)
+    except ValueError:
+        return LOG_LEVELS.index("info")
+
+
+class CoreLogStream:
+    """
+    Subscribes to the controller's `/logs` stream and keeps the most recent
+    lines that pass the level and regex filters in a bounded ring buffer.
+    """
+
+    def __init__(self, size=500, level="info", pattern="", logger=None):
+        self.buffer = deque(maxlen=size)
+        self.level = level
+        self.pattern = pattern
+        self.regex = re.compile(pattern) if pattern else None
+        self.logger = logger
+        self.seq = 0
+        self.connected = False
+        self.task = None
+
+    def set_filter(self, level=None, pattern=None, size=None):
+        """
+        Update the ingestion filters. Lines already in the buffer that no longer
+        pass are dropped, and the stream reconnects when the level changes so the
+        controller stops sending lines below it.
+        """
+        if pattern is not None:
+            # Compile first so an invalid pattern leaves the current filter intact
+            self.regex = re.compile(pattern) if pattern else None
+            self.pattern = pattern
+        level_changed = level is not None and level != self.level
+        if level is not None:
+            self.level = level
+        if size is not None and size != self.buffer.maxlen:
+            self.buffer = deque(self.buffer, maxlen=size)
+        self.buffer = deque(
+            (entry for entry in self.buffer if self.accept(entry)),
+            maxlen=self.buffer.maxlen,
+        )
+        if level_changed and self.task is not None:
+            self.stop()
+            self.start()
+
+    def accept(self, entry):
+        """Check an entry against the ingestion filters."""
+        if level_rank(entry["type"]) < level_rank(self.level):
+            return False
+        if self.regex is not None and not self.regex.search(entry["payload"]):
+            return False
+        return True
+
+    def push(self, log_type, payload):
+        """Add a line to the ring buffer if it passes the filters."""
+        entry = {"type": log_type, "payload": payload}
+        if not self.accept(entry):
+            return False
+        self.seq += 1
+        entry["id"] = self.seq
+        entry["time"] = int(time.time())
+        self.buffer.append(entry)
+        return True
+
+    def query(self, offset=0, limit=50, level=None, pattern=None):
+        """
+        Return a page of buffered lines, newest page first and lines in
+        chronological order within the page. `offset` counts lines back from
+        the newest matching line.
+        """
+        regex = re.compile(pattern) if pattern else None
+        entries = [
+            entry
+            for entry in self.buffer
+            if (level is None or level_rank(entry["type"]) >= level_rank(level))
+            and (regex is None or regex.search(entry["payload"]))
+        ]
+        total = len(entries)
+        end = max(total - offset, 0)
+        start = max(end - limit, 0)
+        return {
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "connected": self.connected,
+            "lines": entries[start:end],
+        }
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.connected = False
+
+    async def run(self):
+        """Keep the subscription alive, reconnecting while the core is down."""
+        delay = 1
+        while True:
+            try:
+                await self.subscribe()
+                delay = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.logger is not None:
+                    self.logger.debug(f"[DeckySpy][B]Core log stream error: {e}")
+            self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def subscribe(self):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=5)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(
+                f"{CONTROLLER_URL}/logs", params={"level": self.level}
+            ) as res:
+                res.raise_for_status()
+                self.connected = True
+                # The controller streams one JSON object per line
+                async for line in res.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        data = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.push(data.get("type", "info"), data.get("payload", ""))
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import time
+
+import aiohttp
+
+CONNECT_TIMEOUT = 10
+# Longest gap allowed between two chunks of a response
+READ_TIMEOUT = 30
+MAX_SIZE = 16 * 1024 * 1024
+# Seconds to wait on a mirror before racing the next one
+STAGGER = 2
+# Errors after which a partial transfer is resumed with a Range request
+RESUMABLE_ERRORS = (
+    aiohttp.ClientPayloadError,
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+)
+
+
+def order_mirrors(urls, latencies):
+    """Sort mirrors fastest first, then untried ones, then the ones that failed."""
+
+    def key(url):
+        if url not in latencies:
+            return (1, 0)
+        if latencies[url] is None:
+            return (2, 0)
+        return (0, latencies[url])
+
+    return sorted(urls, key=key)
+
+
+async def fetch_mirror(
+    session, url, path, ssl_context=None, max_size=MAX_SIZE, attempts=2
+):
+    """
+    Download `url` into `path`. A transfer broken by a network error is
+    resumed from the bytes already written when the server honours Range.
+    """
+    timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT
+    )
+    for attempt in range(attempts):
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            async with session.get(
+                url, ssl=ssl_context, headers=headers, timeout=timeout
+            ) as res:
+                res.raise_for_status()
+                if res.status != 206:
+                    # The server sent the whole body again
+                    offset = 0
+                expected = None
+                if res.content_length is not None:
+                    expected = offset + res.content_length
+                    if expected > max_size:
+                        raise RuntimeError(
+                            f"Response is larger than {max_size} bytes"
+                        )
+                size = offset
+                with open(path, "ab" if offset else "wb") as file:
+                    async for chunk in res.content.iter_chunked(65536):
+                        size += len(chunk)
+                        if size > max_size:
+                            raise RuntimeError(
+                                f"Response is larger than {max_size} bytes"
+                            )
+                        file.write(chunk)
+                if expected is not None and size != expected:
+                    raise aiohttp.ClientPayloadError(f"Got {size} of {expected} bytes")
+                return size
+        except RESUMABLE_ERRORS:
+            if attempt == attempts - 1:
+                raise
+
+
+async def hedged_download(
+    urls, dest_dir, ssl_context=None, validate=None, latencies=None, stagger=STAGGER
+):
+    """
+    Race the mirrors in `urls`, starting the next one whenever the running
+    ones have not finished within `stagger` seconds or one of them fails.
+    The first complete response accepted by `validate` wins and the others
+    are cancelled.
+
+    Returns the winning url and the path of its body. The latency in seconds
+    of each mirror that finished, or None for the ones that failed, is
+    recorded in `latencies` even when every mirror fails.
+    """
+    queue = list(urls)
+    if latencies is None:
+        latencies = {}
+    errors = {}
+    owners = {}
+    pending = set()
+
+    async def attempt(index, url):
+        start = time.monotonic()
+        path = os.path.join(dest_dir, f"mirror-{index}.part")
+        async with aiohttp.ClientSession() as session:
+            await fetch_mirror(session, url, path, ssl_context)
+        if validate is not None and not validate(path):
+            raise RuntimeError("Invalid response")
+        latencies[url] = time.monotonic() - start
+        return url, path
+
+    def launch():
+        url = queue.pop(0)
+        task = asyncio.ensure_future(attempt(len(owners), url))
+        owners[task] = url
+        pending.add(task)
+
+    launch()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=stagger if queue else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                pending.discard(task)
+                if task.exception() is None:
+                    return task.result()
+                errors[owners[task]] = task.exception()
+                latencies[owners[task]] = None
+            # Hedge on a slow mirror, or replace a failed one right away
+            if queue:
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    raise RuntimeError(
+        "All mirrors failed: "
+        + "; ".join(f"{url}: {error}" for url, error in errors.items())
+    )
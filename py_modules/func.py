@@ -1,12 +1,16 @@
 import codecs
 import glob
+import json
 import os
 import shutil
 import subprocess
 from pathlib import Path
+from urllib.parse import unquote
 
 import yaml
 
+from py_modules.subconv import convert_subscription, detect_format
+
 
 def wrap_return(data, code=0):
     return {"code": code, "data": data}
@@ -57,27 +61,6 @@ def check_service_status(service_name: str):
     }
 
 
-def kill_process_on_port(port):
-    """Kill process on a given port using lsof and kill command on Unix."""
-    try:
-        # Find PID using port
-        result = subprocess.run(
-            ["lsof", "-ti", f"tcp:{port}"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if result.stdout:
-            pid = int(result.stdout.strip())
-            # Kill the process using the PID
-            subprocess.run(
-                ["kill", "-9", str(pid)], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            return True
-        return False
-    except Exception:
-        return False
-
-
 def check_services():
     return {
         "tunup": check_service_status("tunup"),
@@ -143,23 +126,187 @@ def set_profile_meta(profile_name, meta_data):
     return True
 
 
-def update_config_file(profile_name, dir_path):
-    profiles_savepath = os.path.join(
-        os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "profiles"
+# Groups generated for merged profiles, keyed by group type
+MERGED_GROUPS = {
+    "url-test": "TunUp-Auto",
+    "fallback": "TunUp-Fallback",
+    "load-balance": "TunUp-Balance",
+}
+# Rule pack sending Steam downloads and Valve game traffic DIRECT
+STEAM_DIRECT_PROVIDER = "steam-direct"
+
+
+def load_profile_yml(profile_name, template_yml, logger=None):
+    profile_yml_path = os.path.join(
+        os.environ["DECKY_PLUGIN_SETTINGS_DIR"],
+        "profiles",
+        f"{profile_name}.yml",
+    )
+    with codecs.open(profile_yml_path, "r", "utf-8") as file:
+        text = file.read()
+    # Subscriptions serving base64 or plain URI lists are converted here
+    profile_meta = get_profile_meta(profile_name) or {}
+    profile_yml, skipped = convert_subscription(
+        text, template_yml, subscription_format=profile_meta.get("format")
     )
+    if skipped and logger is not None:
+        # Only the scheme and name, links carry credentials
+        logger.warning(
+            f"Skipped {len(skipped)} lines in profile {profile_name}: "
+            + ", ".join(
+                f"{line.partition('://')[0]}://#{unquote(line.partition('#')[2])}"
+                for line in skipped
+            )
+        )
+    return profile_yml_path, profile_yml
+
+
+def is_profile_file(path):
+    """
+    Return the subscription format of a downloaded body, or None if it is not
+    one we can load.
+    """
+    try:
+        with codecs.open(path, "r", "utf-8") as file:
+            return detect_format(file.read())
+    except (UnicodeDecodeError, OSError):
+        return None
+
+
+def proxy_endpoint(proxy):
+    """
+    Key identifying what a proxy connects to. Every field but the name takes
+    part, proxies sharing a server can differ in their transport or TLS options.
+    """
+    return json.dumps(
+        {key: value for key, value in proxy.items() if key != "name"},
+        sort_keys=True,
+        default=str,
+    )
+
+
+def rename_rule_target(rule, rename_map):
+    """Rewrite the proxy or group a clash rule routes to through `rename_map`."""
+    parts = [part.strip() for part in str(rule).split(",")]
+    # MATCH,<target> has no payload, other rules are TYPE,payload,target,...
+    target_index = 1 if parts[0].upper() in ("MATCH", "FINAL") else 2
+    if len(parts) <= target_index or parts[target_index] not in rename_map:
+        return rule
+    parts[target_index] = rename_map[parts[target_index]]
+    return ",".join(parts)
+
+
+def merge_profiles(profile_ymls, rules_profile):
+    """
+    Combine the proxies of several profiles into one profile.
+
+    Proxies identical but for their name are kept once, and names that
+    collide across profiles get the profile name appended. The proxy groups
+    and rules of `rules_profile` are kept, with their proxy references
+    renamed, and url-test/fallback/load-balance groups spanning every proxy
+    are added and offered in each of its select groups.
+    """
+    proxies = []
+    endpoints = {}
+    used_names = set()
+    rename_maps = {}
+    for profile_name, profile_yml in profile_ymls:
+        rename_map = rename_maps.setdefault(profile_name, {})
+        for proxy in profile_yml.get("proxies") or []:
+            endpoint = proxy_endpoint(proxy)
+            if endpoint in endpoints:
+                rename_map[proxy["name"]] = endpoints[endpoint]
+                continue
+            name = proxy["name"]
+            if name in used_names:
+                name = f"{proxy['name']} [{profile_name}]"
+                index = 2
+                while name in used_names:
+                    name = f"{proxy['name']} [{profile_name}] {index}"
+                    index += 1
+            used_names.add(name)
+            endpoints[endpoint] = name
+            rename_map[proxy["name"]] = name
+            proxies.append({**proxy, "name": name})
+
+    rules_yml = dict(profile_ymls)[rules_profile]
+    rename_map = rename_maps[rules_profile]
+    proxy_names = [proxy["name"] for proxy in proxies]
+    proxy_groups = []
+    for group in rules_yml.get("proxy-groups") or []:
+        members = []
+        for member in group.get("proxies") or []:
+            member = rename_map.get(member, member)
+            if member not in members:
+                members.append(member)
+        if group.get("type") == "select":
+            members += list(MERGED_GROUPS.values())
+        proxy_groups.append({**group, "proxies": members})
+    for group_type, group_name in MERGED_GROUPS.items():
+        group = {"name": group_name, "type": group_type, "proxies": proxy_names}
+        if group_type == "load-balance":
+            group["strategy"] = "consistent-hashing"
+        group["url"] = "http://www.gstatic.com/generate_204"
+        group["interval"] = 300
+        proxy_groups.append(group)
+    return {
+        "proxies": proxies,
+        "proxy-groups": proxy_groups,
+        "rules": [
+            rename_rule_target(rule, rename_map)
+            for rule in rules_yml.get("rules") or []
+        ],
+    }
+
+
+def update_config_file(profile_name, dir_path, logger=None):
     clash_path = os.path.join(dir_path, "clash")
     config_path = "/home/deck/.config"
     tunup_path = os.path.join(config_path, "tunup")
-    profile_yml_path = os.path.join(profiles_savepath, f"{profile_name}.yml")
-    with codecs.open(profile_yml_path, "r", "utf-8") as file:
-        profile_yml = yaml.safe_load(file)
     template_yml_path = os.path.join(clash_path, "template.yml")
     with codecs.open(template_yml_path, "r", "utf-8") as file:
         template_yml = yaml.safe_load(file)
+    profile_meta = get_profile_meta(profile_name) or {}
+    if profile_meta.get("type") == "merge":
+        profile_yml_path = os.path.join(
+            os.environ["DECKY_PLUGIN_SETTINGS_DIR"],
+            "profiles",
+            f"{profile_name}.meta.yml",
+        )
+        profile_yml = merge_profiles(
+            [
+                (name, load_profile_yml(name, template_yml, logger)[1])
+                for name in profile_meta["profiles"]
+            ],
+            profile_meta["rules_profile"],
+        )
+    else:
+        profile_yml_path, profile_yml = load_profile_yml(
+            profile_name, template_yml, logger
+        )
     config_yml = {**template_yml}
     config_yml["proxies"] = profile_yml["proxies"]
     config_yml["proxy-groups"] = profile_yml["proxy-groups"]
     config_yml["rules"] = profile_yml["rules"]
+    if profile_meta.get("steam_direct", False):
+        rules_path = os.path.join(tunup_path, "rules")
+        os.makedirs(rules_path, exist_ok=True)
+        copy_file(
+            os.path.join(clash_path, "rules", f"{STEAM_DIRECT_PROVIDER}.yml"),
+            os.path.join(rules_path, f"{STEAM_DIRECT_PROVIDER}.yml"),
+        )
+        config_yml["rule-providers"] = {
+            **(config_yml.get("rule-providers") or {}),
+            STEAM_DIRECT_PROVIDER: {
+                "type": "file",
+                "behavior": "classical",
+                "path": f"./rules/{STEAM_DIRECT_PROVIDER}.yml",
+            },
+        }
+        # Matched before any subscription rule
+        config_yml["rules"] = [
+            f"RULE-SET,{STEAM_DIRECT_PROVIDER},DIRECT"
+        ] + config_yml["rules"]
     config_yml_path = os.path.join(tunup_path, "config.yml")
     with codecs.open(config_yml_path, "w", "utf-8") as file:
         yaml.safe_dump(config_yml, file, allow_unicode=True)
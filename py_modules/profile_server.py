@@ -0,0 +1,225 @@
+import asyncio
+import importlib.util
+import os
+import signal
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+PORT = 12345
+# Seconds without requests before the server shuts itself down
+IDLE_TIMEOUT = 600
+
+
+def get_pidfile_path():
+    return os.path.join(os.environ["DECKY_PLUGIN_RUNTIME_DIR"], "profile_server.pid")
+
+
+def read_owner():
+    """Return the (pid, fd) recorded by the process that owns the port, if any."""
+    try:
+        with open(get_pidfile_path(), "r") as file:
+            pid, fd = file.read().split()
+        return int(pid), int(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def listening_inodes(port):
+    """Return the socket inodes listening on `port` according to /proc/net."""
+    inodes = set()
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path, "r") as file:
+                lines = file.readlines()[1:]
+        except OSError:
+            continue
+        for line in lines:
+            fields = line.split()
+            # 0A is TCP_LISTEN, the local address ends with the port in hex
+            if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                inodes.add(fields[9])
+    return inodes
+
+
+def holds_port(pid, fd, port):
+    """Check that file descriptor `fd` of `pid` is the socket listening on `port`."""
+    try:
+        target = os.readlink(f"/proc/{pid}/fd/{fd}")
+    except OSError:
+        return False
+    # Sockets read as socket:[<inode>]
+    if not (target.startswith("socket:[") and target.endswith("]")):
+        return False
+    return target[len("socket:[") : -1] in listening_inodes(port)
+
+
+def release_stale_owner(port=PORT):
+    """
+    Terminate a process that still holds the port according to the pidfile.
+    The pid is only signalled when its recorded fd is the listening socket,
+    a pidfile left behind by a crash or reboot may name a reused pid.
+    Returns True if one was found.
+    """
+    owner = read_owner()
+    if owner is None or owner[0] == os.getpid():
+        return False
+    found = holds_port(owner[0], owner[1], port)
+    if found:
+        try:
+            os.kill(owner[0], signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    try:
+        os.remove(get_pidfile_path())
+    except FileNotFoundError:
+        pass
+    return found
+
+
+class ProfileServer:
+    """
+    Profile web server running inside the plugin process. The port is bound
+    immediately, but download_server.py is only loaded once the first
+    connection arrives, and the server stops after `idle_timeout` seconds
+    without requests.
+    """
+
+    def __init__(
+        self,
+        script_path,
+        profiles_dir,
+        port=PORT,
+        idle_timeout=IDLE_TIMEOUT,
+        on_request=None,
+        on_stop=None,
+        logger=None,
+    ):
+        self.script_path = script_path
+        self.profiles_dir = profiles_dir
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.on_request = on_request
+        self.on_stop = on_stop
+        self.logger = logger
+        self.loop = None
+        self.sock = None
+        self.httpd = None
+        self.idle_task = None
+        self.last_activity = 0
+        # Requests being handled, the server never idles out under one
+        self.active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.sock is not None
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(("", self.port))
+        except OSError:
+            sock.close()
+            raise
+        sock.listen(16)
+        sock.setblocking(False)
+        return sock
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            self.sock = self.bind()
+        except OSError:
+            # Only retry when the pidfile names the process holding the port
+            if not release_stale_owner(self.port):
+                raise
+            time.sleep(0.5)
+            self.sock = self.bind()
+        with open(get_pidfile_path(), "w") as file:
+            file.write(f"{os.getpid()} {self.sock.fileno()}\n")
+        self.loop = asyncio.get_event_loop()
+        self.loop.add_reader(self.sock.fileno(), self.activate)
+        self.touch()
+        self.idle_task = self.loop.create_task(self.watch_idle())
+
+    def activate(self):
+        """Load the request handler and serve the bound socket on a thread."""
+        self.loop.remove_reader(self.sock.fileno())
+        try:
+            self.httpd = self.build_server()
+        except Exception as e:
+            # Nothing would accept on the bound port, release it
+            if self.logger is not None:
+                self.logger.error(f"[DeckySpy][B]Profile server failed to load: {e}")
+            self.loop.create_task(self.stop())
+            return
+        self.sock.setblocking(True)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def build_server(self):
+        spec = importlib.util.spec_from_file_location(
+            "download_server", self.script_path
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        owner = self
+
+        class Handler(module.SimpleHTTPRequestHandler):
+            def handle(self):
+                with owner.lock:
+                    owner.active += 1
+                try:
+                    super().handle()
+                finally:
+                    with owner.lock:
+                        owner.active -= 1
+                    owner.touch()
+                    if owner.on_request is not None:
+                        # Profiles may have changed, tell the plugin
+                        owner.loop.call_soon_threadsafe(owner.on_request)
+
+        httpd = ThreadingHTTPServer(("", self.port), Handler, bind_and_activate=False)
+        # Serve the socket bound in start() instead of a new one
+        httpd.socket.close()
+        httpd.socket = self.sock
+        httpd.profiles_dir = self.profiles_dir
+        return httpd
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    async def watch_idle(self):
+        while True:
+            remaining = self.last_activity + self.idle_timeout - time.monotonic()
+            if self.active > 0:
+                remaining = self.idle_timeout
+            elif remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        self.idle_task = None
+        await self.stop()
+
+    async def stop(self):
+        if not self.running:
+            return
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+            self.idle_task = None
+        if self.httpd is not None:
+            # shutdown() blocks until serve_forever() notices
+            await self.loop.run_in_executor(None, self.httpd.shutdown)
+            self.httpd.server_close()
+            self.httpd = None
+        else:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+        self.sock = None
+        owner = read_owner()
+        if owner is not None and owner[0] == os.getpid():
+            os.remove(get_pidfile_path())
+        if self.on_stop is not None:
+            self.on_stop()
@@ -0,0 +1,91 @@
+import codecs
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+import yaml
+
+# Number of versions kept per profile
+HISTORY_SIZE = 5
+
+
+def get_history_path(profile_name):
+    return os.path.join(
+        os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "history", profile_name
+    )
+
+
+def load_history(profile_name):
+    """Return the stored versions of a profile, newest first."""
+    index_path = os.path.join(get_history_path(profile_name), "index.yml")
+    if not os.path.exists(index_path):
+        return []
+    with codecs.open(index_path, "r", "utf-8") as file:
+        return yaml.safe_load(file) or []
+
+
+def write_atomic(path, data):
+    # Write next to the target then rename, so readers never see a partial file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def save_version(profile_name, profile_path, config_path, keep=HISTORY_SIZE):
+    """
+    Store the profile content and the config built from it, addressed by the
+    sha256 of the profile content, and keep only the `keep` newest versions.
+    """
+    history_path = get_history_path(profile_name)
+    os.makedirs(history_path, exist_ok=True)
+    with open(profile_path, "rb") as file:
+        profile_data = file.read()
+    version = hashlib.sha256(profile_data).hexdigest()
+    blob_path = os.path.join(history_path, f"{version}.yml.gz")
+    if not os.path.exists(blob_path):
+        write_atomic(blob_path, gzip.compress(profile_data))
+    # Always refresh the cached config, options like steam_direct may change it
+    with open(config_path, "rb") as file:
+        write_atomic(
+            os.path.join(history_path, f"{version}.config.yml.gz"),
+            gzip.compress(file.read()),
+        )
+
+    history = [
+        entry for entry in load_history(profile_name) if entry["version"] != version
+    ]
+    history.insert(
+        0, {"version": version, "time": int(time.time()), "size": len(profile_data)}
+    )
+    for entry in history[keep:]:
+        for suffix in (".yml.gz", ".config.yml.gz"):
+            stale_path = os.path.join(history_path, entry["version"] + suffix)
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+    history = history[:keep]
+    write_atomic(
+        os.path.join(history_path, "index.yml"),
+        yaml.safe_dump(history).encode("utf-8"),
+    )
+    return version
+
+
+def restore_version(profile_name, version, profile_path, config_path=None):
+    """
+    Put a stored version back in place of the profile, and its cached config
+    in place of the running config when `config_path` is given.
+    """
+    if version not in [entry["version"] for entry in load_history(profile_name)]:
+        raise ValueError(f"Unknown version {version} of profile {profile_name}")
+    history_path = get_history_path(profile_name)
+    with gzip.open(os.path.join(history_path, f"{version}.yml.gz"), "rb") as file:
+        write_atomic(profile_path, file.read())
+    if config_path is not None:
+        with gzip.open(
+            os.path.join(history_path, f"{version}.config.yml.gz"), "rb"
+        ) as file:
+            write_atomic(config_path, file.read())
+    return True
@@ -0,0 +1,138 @@
+import asyncio
+import codecs
+import os
+import random
+import struct
+import time
+
+import aiohttp
+import yaml
+
+from py_modules.core_logs import CONTROLLER_URL
+
+# DNS listener of the core, see `dns.listen` in template.yml
+DNS_ADDRESS = ("127.0.0.1", 1053)
+PROBE_HOST = "www.gstatic.com"
+TUN_PREFIXES = ("utun", "tun", "clash", "Meta")
+# Number of readiness results kept
+HISTORY_SIZE = 50
+
+
+def tun_interfaces():
+    try:
+        names = os.listdir("/sys/class/net")
+    except OSError:
+        return []
+    return [name for name in names if name.startswith(TUN_PREFIXES)]
+
+
+def build_dns_query(host, query_id):
+    """Build a recursive DNS query for the A record of `host`."""
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    qname = b"".join(
+        bytes([len(label)]) + label.encode("ascii") for label in host.split(".")
+    )
+    return header + qname + b"\x00" + struct.pack("!HH", 1, 1)
+
+
+class DnsProbe(asyncio.DatagramProtocol):
+    def __init__(self, query_id):
+        self.query_id = query_id
+        self.answer = asyncio.get_event_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12 or self.answer.done():
+            return
+        query_id, flags = struct.unpack("!HH", data[:4])
+        if query_id == self.query_id:
+            # Answered without error (RCODE 0)
+            self.answer.set_result(flags & 0x000F == 0)
+
+    def error_received(self, exc):
+        if not self.answer.done():
+            self.answer.set_result(False)
+
+
+async def check_controller():
+    timeout = aiohttp.ClientTimeout(total=1)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(f"{CONTROLLER_URL}/version") as res:
+                return res.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+async def check_tun():
+    return len(tun_interfaces()) > 0
+
+
+async def check_dns():
+    query_id = random.randint(0, 0xFFFF)
+    loop = asyncio.get_event_loop()
+    transport, probe = await loop.create_datagram_endpoint(
+        lambda: DnsProbe(query_id), remote_addr=DNS_ADDRESS
+    )
+    try:
+        transport.sendto(build_dns_query(PROBE_HOST, query_id))
+        return await asyncio.wait_for(probe.answer, 1)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        transport.close()
+
+
+CHECKS = [
+    ("controller", check_controller),
+    ("tun", check_tun),
+    ("dns", check_dns),
+]
+
+
+async def wait_until_ready(deadline=30, interval=0.2):
+    """
+    Wait for the core to answer on the controller, bring up its TUN interface
+    and resolve through its DNS listener, in that order. Returns the seconds
+    from the call until each stage passed and whether all passed before the
+    deadline.
+    """
+    start = time.monotonic()
+    stages = {}
+    failed = None
+    for name, check in CHECKS:
+        while not await check():
+            if time.monotonic() - start > deadline:
+                failed = name
+                break
+            await asyncio.sleep(interval)
+        if failed is not None:
+            break
+        stages[name] = round(time.monotonic() - start, 3)
+    return {
+        "ready": failed is None,
+        "elapsed": round(time.monotonic() - start, 3),
+        "stages": stages,
+        "failed": failed,
+        "time": int(time.time()),
+    }
+
+
+def get_history_path():
+    return os.path.join(os.environ["DECKY_PLUGIN_SETTINGS_DIR"], "readiness.yml")
+
+
+def load_readiness_history():
+    """Return the recorded readiness results, newest first."""
+    history_path = get_history_path()
+    if not os.path.exists(history_path):
+        return []
+    with codecs.open(history_path, "r", "utf-8") as file:
+        return yaml.safe_load(file) or []
+
+
+def record_readiness(result, reason, keep=HISTORY_SIZE):
+    history = load_readiness_history()
+    history.insert(0, {**result, "reason": reason})
+    with codecs.open(get_history_path(), "w", "utf-8") as file:
+        yaml.safe_dump(history[:keep], file)
+    return history[:keep]
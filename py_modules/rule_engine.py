@@ -0,0 +1,335 @@
+import bisect
+import codecs
+import ipaddress
+import os
+
+import yaml
+
+DOMAIN_TYPES = ("DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD")
+IP_TYPES = ("IP-CIDR", "IP-CIDR6")
+FINAL_TYPES = ("MATCH", "FINAL")
+
+
+class DomainNode:
+    __slots__ = ("children", "exact", "suffix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.suffix = None
+
+
+class DomainTrie:
+    """Trie over reversed domain labels, `www.example.com` is stored as com/example/www."""
+
+    def __init__(self):
+        self.root = DomainNode()
+
+    def insert(self, domain, suffix, index):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.children.setdefault(label, DomainNode())
+        # Rules are inserted in order, the first one for a node wins
+        if suffix and node.suffix is None:
+            node.suffix = index
+        elif not suffix and node.exact is None:
+            node.exact = index
+
+    def covering(self, domain, suffix):
+        """Return the index of an inserted rule matching everything `domain` matches."""
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.children.get(label)
+            if node is None:
+                return None
+            if node.suffix is not None:
+                return node.suffix
+        if not suffix:
+            return node.exact
+        return None
+
+    def match(self, host):
+        best = None
+        node = self.root
+        for label in reversed(host.split(".")):
+            node = node.children.get(label)
+            if node is None:
+                return best
+            if node.suffix is not None and (best is None or node.suffix < best):
+                best = node.suffix
+        if node.exact is not None and (best is None or node.exact < best):
+            best = node.exact
+        return best
+
+
+class CidrNode:
+    __slots__ = ("children", "index", "resolving")
+
+    def __init__(self):
+        self.children = [None, None]
+        self.index = None
+        # First rule for this network that also matches domain queries
+        self.resolving = None
+
+
+class CidrTree:
+    """Binary radix tree over address bits, one root per IP version."""
+
+    def __init__(self):
+        self.roots = {4: CidrNode(), 6: CidrNode()}
+
+    @staticmethod
+    def bits(address, length):
+        value = int(address)
+        width = address.max_prefixlen
+        for i in range(length):
+            yield (value >> (width - 1 - i)) & 1
+
+    def insert(self, network, index, resolving=False):
+        node = self.roots[network.version]
+        for bit in self.bits(network.network_address, network.prefixlen):
+            if node.children[bit] is None:
+                node.children[bit] = CidrNode()
+            node = node.children[bit]
+        if node.index is None:
+            node.index = index
+        if resolving and node.resolving is None:
+            node.resolving = index
+
+    def covering(self, network, resolving=False):
+        """
+        Return the index of an inserted rule matching everything `network`
+        matches. A resolving rule is also evaluated for domain queries, so
+        it is only covered by rules that resolve too.
+        """
+        node = self.roots[network.version]
+        field = "resolving" if resolving else "index"
+        if getattr(node, field) is not None:
+            return getattr(node, field)
+        for bit in self.bits(network.network_address, network.prefixlen):
+            node = node.children[bit]
+            if node is None:
+                return None
+            if getattr(node, field) is not None:
+                return getattr(node, field)
+        return None
+
+    def match(self, address):
+        node = self.roots[address.version]
+        best = node.index
+        for bit in self.bits(address, address.max_prefixlen):
+            node = node.children[bit]
+            if node is None:
+                break
+            if node.index is not None and (best is None or node.index < best):
+                best = node.index
+        return best
+
+
+def parse_rule(rule):
+    """Split a clash rule into (type, payload, target, options)."""
+    parts = [part.strip() for part in rule.split(",")]
+    rule_type = parts[0].upper()
+    if rule_type in FINAL_TYPES:
+        return rule_type, "", parts[1] if len(parts) > 1 else "", []
+    # A rule without payload is kept, it is reported as unevaluated
+    payload = parts[1] if len(parts) > 1 else ""
+    return rule_type, payload, parts[2] if len(parts) > 2 else "", parts[3:]
+
+
+def load_rule_provider(provider, base_path):
+    """Return the payload of a local rule-provider, or None if it can not be read."""
+    path = provider.get("path")
+    if path is None or base_path is None:
+        return None
+    path = os.path.join(base_path, path)
+    if not os.path.exists(path):
+        return None
+    with codecs.open(path, "r", "utf-8") as file:
+        return (yaml.safe_load(file) or {}).get("payload") or []
+
+
+def expand_rule_set(name, target, rule_providers, base_path):
+    """Expand a RULE-SET into classical rules, or None if it can not be read."""
+    provider = (rule_providers or {}).get(name)
+    if provider is None:
+        return None
+    payload = load_rule_provider(provider, base_path)
+    if payload is None:
+        return None
+    behavior = provider.get("behavior", "classical")
+    rules = []
+    for item in payload:
+        item = str(item).strip()
+        if behavior == "domain":
+            if item.startswith("+."):
+                rules.append(f"DOMAIN-SUFFIX,{item[2:]},{target}")
+            elif "*" in item:
+                # Wildcards can not be indexed, keep them as unevaluated rules
+                rules.append(f"DOMAIN-WILDCARD,{item},{target}")
+            else:
+                rules.append(f"DOMAIN,{item},{target}")
+        elif behavior == "ipcidr":
+            rules.append(f"IP-CIDR,{item},{target}")
+        else:
+            rule_type, _, rest = item.partition(",")
+            payload_part, _, options = rest.partition(",")
+            rule = f"{rule_type},{payload_part},{target}"
+            rules.append(f"{rule},{options}" if options else rule)
+    return rules
+
+
+class RuleEngine:
+    """
+    Compile clash rules into indexes and answer which rule a host or IP hits.
+
+    Rules that can not be evaluated offline (GEOIP, process or port rules,
+    unreadable rule sets, and IP rules that need a DNS lookup for a domain
+    query) are reported as `skipped` when they come before the matched rule.
+    """
+
+    def __init__(self, rules, rule_providers=None, base_path=None):
+        self.rules = []
+        self.domains = DomainTrie()
+        self.keywords = []
+        self.cidrs = CidrTree()
+        self.unevaluated = []
+        self.resolving = []
+        self.final = None
+        self.shadowed = []
+        self.unreachable = []
+        for line, rule in enumerate(rules):
+            rule_type, payload, target, _ = parse_rule(rule)
+            expanded = None
+            if rule_type == "RULE-SET":
+                expanded = expand_rule_set(payload, target, rule_providers, base_path)
+            if expanded is None:
+                self.add(rule, line, rule)
+            else:
+                for sub_rule in expanded:
+                    self.add(sub_rule, line, rule)
+        # Rules a domain query can not evaluate, merged once instead of per query
+        self.unresolved = sorted(self.unevaluated + self.resolving)
+
+    def add(self, rule, line, source):
+        index = len(self.rules)
+        rule_type, payload, target, options = parse_rule(rule)
+        entry = {"rule": source, "line": line, "target": target}
+        if rule != source:
+            entry["sub_rule"] = rule
+        self.rules.append(entry)
+        if self.final is not None:
+            self.unreachable.append(entry)
+            return
+        if rule_type in FINAL_TYPES:
+            self.final = index
+            return
+        covered = None
+        if not payload:
+            self.unevaluated.append(index)
+            return
+        if rule_type in ("DOMAIN", "DOMAIN-SUFFIX"):
+            payload = payload.lower().rstrip(".")
+            suffix = rule_type == "DOMAIN-SUFFIX"
+            covered = self.domains.covering(payload, suffix)
+            for keyword, keyword_index in self.keywords:
+                if keyword in payload and (covered is None or keyword_index < covered):
+                    covered = keyword_index
+            self.domains.insert(payload, suffix, index)
+        elif rule_type == "DOMAIN-KEYWORD":
+            payload = payload.lower()
+            for keyword, keyword_index in self.keywords:
+                if keyword in payload:
+                    covered = keyword_index
+                    break
+            self.keywords.append((payload, index))
+        elif rule_type in IP_TYPES:
+            try:
+                network = ipaddress.ip_network(payload, strict=False)
+            except ValueError:
+                self.unevaluated.append(index)
+                return
+            resolving = "no-resolve" not in options
+            covered = self.cidrs.covering(network, resolving)
+            self.cidrs.insert(network, index, resolving)
+            if resolving:
+                self.resolving.append(index)
+        else:
+            self.unevaluated.append(index)
+            return
+        if covered is not None:
+            self.shadowed.append(
+                {**entry, "shadowed_by": self.describe(self.rules[covered])}
+            )
+
+    @staticmethod
+    def describe(entry):
+        return entry.get("sub_rule", entry["rule"])
+
+    def match(self, host_or_ip):
+        """Return the first rule `host_or_ip` hits and its target."""
+        query = host_or_ip.strip().lower().rstrip(".")
+        try:
+            address = ipaddress.ip_address(query)
+        except ValueError:
+            address = None
+        if address is not None:
+            best = self.cidrs.match(address)
+        else:
+            best = self.domains.match(query)
+            for keyword, index in self.keywords:
+                if best is not None and index > best:
+                    break
+                if keyword in query:
+                    best = index
+                    break
+        if best is None:
+            best = self.final
+        skipped = self.unevaluated if address is not None else self.unresolved
+        limit = len(skipped) if best is None else bisect.bisect_left(skipped, best)
+        result = {
+            "query": host_or_ip,
+            "matched": best is not None,
+            "skipped": [self.describe(self.rules[index]) for index in skipped[:limit]],
+        }
+        if best is not None:
+            entry = self.rules[best]
+            result.update(
+                {
+                    "rule": self.describe(entry),
+                    "line": entry["line"],
+                    "target": entry["target"],
+                }
+            )
+        return result
+
+    def match_many(self, hosts):
+        return [self.match(host) for host in hosts]
+
+    def audit(self):
+        """Return the rules that can never match."""
+        return {
+            "total": len(self.rules),
+            "shadowed": self.shadowed,
+            "unreachable": self.unreachable,
+        }
+
+
+engine_cache = {}
+
+
+def load_engine(config_path):
+    """Compile the rules of a clash config, reusing the result until it changes."""
+    mtime = os.path.getmtime(config_path)
+    cached = engine_cache.get(config_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with codecs.open(config_path, "r", "utf-8") as file:
+        config_yml = yaml.safe_load(file)
+    engine = RuleEngine(
+        config_yml.get("rules") or [],
+        config_yml.get("rule-providers"),
+        os.path.dirname(config_path),
+    )
+    engine_cache[config_path] = (mtime, engine)
+    return engine
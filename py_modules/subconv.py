@@ -0,0 +1,299 @@
+import base64
+import binascii
+import io
+import json
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yaml
+
+SCHEMES = ("ss", "vmess", "trojan", "vless")
+# Proxy types the bundled Clash Premium core can load
+SUPPORTED_TYPES = ("ss", "vmess", "trojan")
+
+
+def b64decode(data):
+    """Decode standard or urlsafe base64 with or without padding."""
+    data = data.strip().replace("-", "+").replace("_", "/")
+    data += "=" * (-len(data) % 4)
+    return base64.b64decode(data)
+
+
+def has_scheme(line):
+    scheme, sep, _ = line.partition("://")
+    return bool(sep) and scheme.lower() in SCHEMES
+
+
+def parse_subscription(text, subscription_format=None):
+    """
+    Return the format of a subscription body and its payload: the parsed
+    YAML for "clash", the URI list text for "uri" and "base64", or
+    (None, None) if the format is not recognised. A known format skips the
+    detection of the others, falling back to it when the body does not match.
+    """
+    if subscription_format in (None, "clash"):
+        try:
+            data = yaml.safe_load(text)
+        except yaml.YAMLError:
+            data = None
+        if isinstance(data, dict) and "proxies" in data:
+            return "clash", data
+    if subscription_format in (None, "uri"):
+        for line in text.splitlines():
+            line = line.strip()
+            if line:
+                if has_scheme(line):
+                    return "uri", text
+                break
+    if subscription_format in (None, "base64"):
+        try:
+            decoded = b64decode("".join(text.split())).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            decoded = ""
+        if any(has_scheme(line.strip()) for line in decoded.splitlines()):
+            return "base64", decoded
+    if subscription_format is not None:
+        return parse_subscription(text)
+    return None, None
+
+
+def detect_format(text):
+    """
+    Return "clash" for Clash YAML, "uri" for a plain URI list, "base64" for a
+    base64 encoded URI list, or None if the format is not recognised.
+    """
+    return parse_subscription(text)[0]
+
+
+def query_value(query, key, default=None):
+    values = query.get(key)
+    return values[0] if values else default
+
+
+def transport_opts(proxy, network, host, path, service_name=None):
+    """Fill the clash transport options shared by vmess, trojan and vless."""
+    if network in (None, "", "tcp"):
+        return
+    proxy["network"] = network
+    if network == "ws":
+        ws_opts = {"path": path or "/"}
+        if host:
+            ws_opts["headers"] = {"Host": host}
+        proxy["ws-opts"] = ws_opts
+    elif network == "grpc":
+        proxy["grpc-opts"] = {"grpc-service-name": service_name or path or ""}
+    elif network == "h2":
+        proxy["h2-opts"] = {"host": [host] if host else [], "path": path or "/"}
+    elif network == "http":
+        proxy["http-opts"] = {"path": [path or "/"]}
+        if host:
+            proxy["http-opts"]["headers"] = {"Host": [host]}
+
+
+def parse_ss(uri):
+    # ss://base64(method:password)@host:port/?plugin=...#name (SIP002)
+    # ss://base64(method:password@host:port)#name (legacy)
+    body, _, name = uri[len("ss://") :].partition("#")
+    body, _, query_string = body.partition("?")
+    body = body.rstrip("/")
+    if "@" not in body:
+        body = b64decode(body).decode("utf-8")
+    userinfo, _, hostport = body.rpartition("@")
+    userinfo = unquote(userinfo)
+    if ":" not in userinfo:
+        userinfo = b64decode(userinfo).decode("utf-8")
+    cipher, _, password = userinfo.partition(":")
+    server, _, port = hostport.rpartition(":")
+    proxy = {
+        "name": unquote(name),
+        "type": "ss",
+        "server": server.strip("[]"),
+        "port": int(port),
+        "cipher": cipher,
+        "password": password,
+        "udp": True,
+    }
+    plugin = query_value(parse_qs(query_string), "plugin")
+    if plugin:
+        plugin_name, *plugin_args = plugin.split(";")
+        args = dict(arg.partition("=")[::2] for arg in plugin_args)
+        if plugin_name in ("obfs-local", "simple-obfs"):
+            proxy["plugin"] = "obfs"
+            proxy["plugin-opts"] = {
+                "mode": args.get("obfs", "http"),
+                "host": args.get("obfs-host", ""),
+            }
+        elif plugin_name == "v2ray-plugin":
+            proxy["plugin"] = "v2ray-plugin"
+            proxy["plugin-opts"] = {
+                "mode": args.get("mode", "websocket"),
+                "tls": "tls" in args,
+                "host": args.get("host", ""),
+                "path": args.get("path", "/"),
+            }
+    return proxy
+
+
+def parse_vmess(uri):
+    # vmess://base64(json) in the v2rayN format
+    data = json.loads(b64decode(uri[len("vmess://") :]).decode("utf-8"))
+    proxy = {
+        "name": data.get("ps", ""),
+        "type": "vmess",
+        "server": data["add"],
+        "port": int(data["port"]),
+        "uuid": data["id"],
+        "alterId": int(data.get("aid") or 0),
+        "cipher": data.get("scy") or "auto",
+        "udp": True,
+    }
+    if data.get("tls") == "tls":
+        proxy["tls"] = True
+        if data.get("sni"):
+            proxy["servername"] = data["sni"]
+    transport_opts(proxy, data.get("net"), data.get("host"), data.get("path"))
+    return proxy
+
+
+def parse_trojan(uri):
+    # trojan://password@host:port?sni=...&type=ws&path=...#name
+    parts = urlsplit(uri)
+    query = parse_qs(parts.query)
+    proxy = {
+        "name": unquote(parts.fragment),
+        "type": "trojan",
+        "server": parts.hostname,
+        "port": parts.port or 443,
+        "password": unquote(parts.username or ""),
+        "udp": True,
+    }
+    sni = query_value(query, "sni") or query_value(query, "peer")
+    if sni:
+        proxy["sni"] = sni
+    if query_value(query, "allowInsecure") in ("1", "true"):
+        proxy["skip-cert-verify"] = True
+    transport_opts(
+        proxy,
+        query_value(query, "type"),
+        query_value(query, "host"),
+        unquote(query_value(query, "path", "")),
+        query_value(query, "serviceName"),
+    )
+    return proxy
+
+
+def parse_vless(uri):
+    # vless://uuid@host:port?security=tls&type=ws&...#name
+    parts = urlsplit(uri)
+    query = parse_qs(parts.query)
+    proxy = {
+        "name": unquote(parts.fragment),
+        "type": "vless",
+        "server": parts.hostname,
+        "port": parts.port or 443,
+        "uuid": unquote(parts.username or ""),
+        "udp": True,
+    }
+    security = query_value(query, "security", "none")
+    if security in ("tls", "reality"):
+        proxy["tls"] = True
+        sni = query_value(query, "sni")
+        if sni:
+            proxy["servername"] = sni
+    if security == "reality":
+        proxy["reality-opts"] = {
+            "public-key": query_value(query, "pbk", ""),
+            "short-id": query_value(query, "sid", ""),
+        }
+    if query_value(query, "flow"):
+        proxy["flow"] = query_value(query, "flow")
+    if query_value(query, "fp"):
+        proxy["client-fingerprint"] = query_value(query, "fp")
+    transport_opts(
+        proxy,
+        query_value(query, "type"),
+        query_value(query, "host"),
+        unquote(query_value(query, "path", "")),
+        query_value(query, "serviceName"),
+    )
+    return proxy
+
+
+PARSERS = {
+    "ss": parse_ss,
+    "vmess": parse_vmess,
+    "trojan": parse_trojan,
+    "vless": parse_vless,
+}
+
+
+def iter_proxies(lines):
+    """
+    Decode URI lines into clash proxy dicts one at a time. Lines that can not
+    be decoded are yielded as (None, line) so callers can report them.
+    """
+    for line in lines:
+        line = line.strip()
+        if not has_scheme(line):
+            continue
+        scheme = line.partition("://")[0].lower()
+        try:
+            yield PARSERS[scheme](line), line
+        except (
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            UnicodeDecodeError,
+            binascii.Error,
+        ):
+            yield None, line
+
+
+def convert_subscription(
+    text, template_yml, supported_types=SUPPORTED_TYPES, subscription_format=None
+):
+    """
+    Convert a subscription body into a clash profile and the list of lines
+    that were skipped. Clash YAML is returned as is; URI lists are decoded in
+    a single pass and wrapped with the proxy groups and rules of the template,
+    every template group offering all proxies. `subscription_format` is the
+    format detected when the body was downloaded, if known.
+
+    Raises ValueError if the body is not recognised or has no usable proxy.
+    """
+    subscription_format, payload = parse_subscription(text, subscription_format)
+    if subscription_format == "clash":
+        return payload, []
+    if subscription_format is None:
+        raise ValueError("Unrecognised subscription format")
+    proxies = []
+    names = set()
+    skipped = []
+    for proxy, line in iter_proxies(io.StringIO(payload)):
+        if proxy is None or proxy["type"] not in supported_types:
+            skipped.append(line)
+            continue
+        name = proxy["name"] or f"{proxy['server']}:{proxy['port']}"
+        unique_name = name
+        index = 2
+        while unique_name in names:
+            unique_name = f"{name} {index}"
+            index += 1
+        names.add(unique_name)
+        proxy["name"] = unique_name
+        proxies.append(proxy)
+    if not proxies:
+        raise ValueError(
+            f"Subscription has no supported proxy, {len(skipped)} lines skipped"
+        )
+    proxy_names = [proxy["name"] for proxy in proxies]
+    proxy_groups = [
+        {**group, "proxies": list(group.get("proxies") or []) + proxy_names}
+        for group in template_yml.get("proxy-groups") or []
+    ]
+    profile_yml = {
+        "proxies": proxies,
+        "proxy-groups": proxy_groups,
+        "rules": list(template_yml.get("rules") or []),
+    }
+    return profile_yml, skipped
@@ -15,6 +15,8 @@ export class Backend {
 
     private serverAPI: ServerAPI;
     private token = '';
+    private stateVersion = 0;
+    private stateEpoch: string | null = null;
     constructor(serverAPI: ServerAPI) {
         this.serverAPI = serverAPI;
     }
@@ -29,11 +31,41 @@ export class Backend {
         return true;
     }
     async updateInfo() {
-        await this.getVersion();
-        await this.checkServices();
-        await this.getProfiles();
-        await this.updateProfileMeta();
-        await this.checkServer();
+        await this.syncState();
+    }
+
+    // Apply the state changed since the last sync. Returns whether anything
+    // changed, or null when the backend could not be reached.
+    async syncState() {
+        const ret = await this.bridge('get_state_since', {
+            version: this.stateVersion,
+            epoch: this.stateEpoch,
+        });
+        if (ret == null) {
+            return null;
+        }
+        this.stateEpoch = ret.epoch;
+        this.stateVersion = ret.version;
+        const changes = ret.changes;
+        if (changes.version !== undefined) {
+            this.backendInfo.version = changes.version;
+        }
+        if (changes.services !== undefined) {
+            this.backendInfo.serviceStatus = changes.services;
+        }
+        if (changes.profiles !== undefined) {
+            this.backendInfo.profiles = changes.profiles;
+        }
+        if (changes.profile_meta !== undefined) {
+            this.backendInfo.profile_meta = changes.profile_meta;
+        }
+        if (changes.server !== undefined) {
+            this.backendInfo.serverStatus = changes.server;
+        }
+        if (changes.refresh !== undefined) {
+            this.backendInfo.refresh = changes.refresh;
+        }
+        return Object.keys(changes).length > 0;
     }
 
     // Avoid repeated setup after reload
@@ -67,6 +99,33 @@ export class Backend {
         }
     }
 
+    async getCoreLogs(
+        offset = 0,
+        limit = 50,
+        level: string | null = null,
+        pattern: string | null = null,
+    ) {
+        return await this.bridge('get_core_logs', {
+            offset,
+            limit,
+            level,
+            pattern,
+        });
+    }
+    async setCoreLogFilter(level: string | null, pattern: string | null) {
+        return await this.bridge('set_core_log_filter', { level, pattern });
+    }
+
+    async matchRule(host: string) {
+        return await this.bridge('match_rule', { host });
+    }
+    async matchRules(hosts: string[]) {
+        return await this.bridge('match_rules', { hosts });
+    }
+    async auditRules() {
+        return await this.bridge('audit_rules');
+    }
+
     async startServer() {
         return await this.bridge('start_server');
     }
@@ -83,6 +142,9 @@ export class Backend {
     async uninstallService() {
         return await this.bridge('uninstall_service');
     }
+    async getReadinessHistory() {
+        return await this.bridge('get_readiness_history');
+    }
     async startService(service: string) {
         return await this.bridge('start_service', { service });
     }
@@ -104,6 +166,29 @@ export class Backend {
         return await this.bridge('update_profile', { profile_name });
     }
 
+    async getProfileHistory(profile_name: string) {
+        return await this.bridge('get_profile_history', { profile_name });
+    }
+    async rollbackProfile(profile_name: string, version: string) {
+        return await this.bridge('rollback_profile', { profile_name, version });
+    }
+
+    async setSteamDirect(profile_name: string, enabled: boolean) {
+        return await this.bridge('set_steam_direct', { profile_name, enabled });
+    }
+
+    async createMergedProfile(
+        profile_name: string,
+        profiles: string[],
+        rules_profile: string,
+    ) {
+        return await this.bridge('create_merged_profile', {
+            profile_name,
+            profiles,
+            rules_profile,
+        });
+    }
+
     async getSettings(key: string, defaultValue: any) {
         const result = await this.bridge('get_settings', {
             key,
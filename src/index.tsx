@@ -38,9 +38,33 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
     const [profileMeta, setProfileMeta] = useState<{
         type: string;
         update_time: number;
+        steam_direct: boolean;
     }>(backend.backendInfo.profile_meta);
 
-    useEffect(() => {}, []);
+    useEffect(() => {
+        // Poll the versioned backend state while the panel is open. The
+        // backend handles one call at a time, so polls must answer at once
+        // and leave room for the calls made by the controls.
+        let mounted = true;
+        let timer: ReturnType<typeof setTimeout> | undefined;
+        const poll = async () => {
+            const changed = await backend.syncState();
+            if (!mounted) {
+                return;
+            }
+            if (changed) {
+                setBackendInfo({ ...backend.backendInfo });
+                setProfileMeta(backend.backendInfo.profile_meta);
+            }
+            // Keep polling after a failed call, the backend may be reloading
+            timer = setTimeout(poll, changed === null ? 5000 : 2000);
+        };
+        poll();
+        return () => {
+            mounted = false;
+            clearTimeout(timer);
+        };
+    }, []);
     return (
         <div>
             <PanelSection title="Profile Select">
@@ -79,7 +103,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                         backend.settings.profile = x.data;
                         await backend.saveSettings();
                         setCurrentSub(x.data);
-                        await backend.updateProfileMeta();
+                        await backend.syncState();
                         setProfileMeta(backend.backendInfo.profile_meta);
                         setWorking(false);
                     }}
@@ -97,7 +121,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                             onClick={async () => {
                                 setWorking(true);
                                 await backend.updateProfile(currentSub);
-                                await backend.updateProfileMeta();
+                                await backend.syncState();
                                 setProfileMeta(
                                     backend.backendInfo.profile_meta,
                                 );
@@ -106,6 +130,21 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                         >
                             Update Profile
                         </ButtonItem>
+                        <ToggleField
+                            label="Steam Direct"
+                            description="Send Steam downloads and Valve game servers DIRECT"
+                            disabled={working}
+                            checked={profileMeta.steam_direct}
+                            onChange={async (value) => {
+                                setWorking(true);
+                                await backend.setSteamDirect(currentSub, value);
+                                await backend.syncState();
+                                setProfileMeta(
+                                    backend.backendInfo.profile_meta,
+                                );
+                                setWorking(false);
+                            }}
+                        />
                         {/* <ToggleField
                             label="Auto Update"
                             description="Auto update profile"
@@ -134,7 +173,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                         } else {
                             await backend.uninstallService();
                         }
-                        await backend.checkServices();
+                        await backend.syncState();
                         setBackendInfo({ ...backend.backendInfo });
                         setWorking(false);
                     }}
@@ -169,7 +208,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                     disabled={backend.backendInfo.serverStatus}
                     onClick={async () => {
                         await backend.startServer();
-                        await backend.checkServer();
+                        await backend.syncState();
                         setBackendInfo({ ...backend.backendInfo });
                     }}
                 >
@@ -180,7 +219,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                     disabled={!backend.backendInfo.serverStatus}
                     onClick={async () => {
                         await backend.stopServer();
-                        await backend.checkServer();
+                        await backend.syncState();
                         setBackendInfo({ ...backend.backendInfo });
                     }}
                 >
@@ -205,7 +244,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                             } else {
                                 await backend.stopService('tunup');
                             }
-                            await backend.checkServices();
+                            await backend.syncState();
                             setBackendInfo({ ...backend.backendInfo });
                         }}
                     />
@@ -228,7 +267,7 @@ const Content: VFC<{ backend: Backend }> = ({ backend }) => {
                             } else {
                                 await backend.disableResolved();
                             }
-                            await backend.checkServices();
+                            await backend.syncState();
                             setBackendInfo({ ...backend.backendInfo });
                         }}
                     />
@@ -15,6 +15,7 @@ export interface BackendInfo {
     profile_meta: {
         type: string;
         update_time: number;
+        steam_direct: boolean;
     };
     serviceStatus: {
         [key: string]: {
@@ -24,6 +25,11 @@ export interface BackendInfo {
         };
     };
     serverStatus: boolean;
+    refresh: {
+        profile: string;
+        stage: string;
+        time: number;
+    };
 }
 export const DefaultBackendInfo: BackendInfo = {
     version: '0.0.0',
@@ -31,6 +37,7 @@ export const DefaultBackendInfo: BackendInfo = {
 	profile_meta: {
 		type: '',
 		update_time: 0,
+		steam_direct: false,
 	},
     serviceStatus: {
         tunup: {
@@ -45,6 +52,11 @@ export const DefaultBackendInfo: BackendInfo = {
         },
     },
     serverStatus: false,
+    refresh: {
+        profile: '',
+        stage: '',
+        time: 0,
+    },
 };
 
 export interface Settings {
@@ -0,0 +1,84 @@
+from py_modules.func import MERGED_GROUPS, merge_profiles
+
+
+def ss(name, server, **extra):
+    return {
+        "name": name,
+        "type": "ss",
+        "server": server,
+        "port": 8388,
+        "cipher": "aes-256-gcm",
+        "password": "secret",
+        **extra,
+    }
+
+
+def profile(proxies, groups=None, rules=None):
+    return {"proxies": proxies, "proxy-groups": groups or [], "rules": rules or []}
+
+
+def names(merged):
+    return [proxy["name"] for proxy in merged["proxies"]]
+
+
+def groups(merged):
+    return {group["name"]: group for group in merged["proxy-groups"]}
+
+
+def test_identical_proxies_are_kept_once():
+    a = profile([ss("JP", "jp.example.com")])
+    b = profile([ss("JP-dup", "jp.example.com")])
+    merged = merge_profiles([("a", a), ("b", b)], "a")
+    assert names(merged) == ["JP"]
+
+
+def test_proxies_differing_in_options_are_kept():
+    a = profile([ss("CDN", "cdn.example.com", **{"plugin-opts": {"host": "a"}})])
+    b = profile([ss("CDN", "cdn.example.com", **{"plugin-opts": {"host": "b"}})])
+    merged = merge_profiles([("a", a), ("b", b)], "a")
+    assert names(merged) == ["CDN", "CDN [b]"]
+
+
+def test_colliding_names_get_the_profile_name():
+    a = profile([ss("HK", "hk-a.example.com"), ss("HK [b]", "hk-c.example.com")])
+    b = profile([ss("HK", "hk-b.example.com")])
+    merged = merge_profiles([("a", a), ("b", b)], "a")
+    assert names(merged) == ["HK", "HK [b]", "HK [b] 2"]
+
+
+def test_group_and_rule_references_are_renamed():
+    a = profile([ss("HK", "hk-a.example.com"), ss("JP", "jp.example.com")])
+    b = profile(
+        [ss("HK", "hk-b.example.com"), ss("JP-dup", "jp.example.com")],
+        groups=[
+            {"name": "Proxy", "type": "select", "proxies": ["HK", "JP-dup", "DIRECT"]}
+        ],
+        rules=[
+            "DOMAIN,hk.example.com,HK",
+            "DOMAIN-SUFFIX,jp.example.com,JP-dup",
+            "IP-CIDR,10.0.0.0/8,HK,no-resolve",
+            "GEOIP,CN,DIRECT",
+            "MATCH,Proxy",
+        ],
+    )
+    merged = merge_profiles([("a", a), ("b", b)], "b")
+    assert groups(merged)["Proxy"]["proxies"] == ["HK [b]", "JP", "DIRECT"] + list(
+        MERGED_GROUPS.values()
+    )
+    assert merged["rules"] == [
+        "DOMAIN,hk.example.com,HK [b]",
+        "DOMAIN-SUFFIX,jp.example.com,JP",
+        "IP-CIDR,10.0.0.0/8,HK [b],no-resolve",
+        "GEOIP,CN,DIRECT",
+        "MATCH,Proxy",
+    ]
+
+
+def test_merged_groups_span_every_proxy():
+    a = profile([ss("A", "a.example.com")])
+    b = profile([ss("B", "b.example.com")])
+    merged = merge_profiles([("a", a), ("b", b)], "a")
+    for group_type, group_name in MERGED_GROUPS.items():
+        group = groups(merged)[group_name]
+        assert group["type"] == group_type
+        assert group["proxies"] == ["A", "B"]
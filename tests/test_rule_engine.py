@@ -0,0 +1,132 @@
+import pytest
+
+from py_modules.rule_engine import RuleEngine, load_engine
+
+RULES = [
+    "DOMAIN,exact.example.com,Exact",
+    "DOMAIN-SUFFIX,example.com,Suffix",
+    "DOMAIN-KEYWORD,tracker,Reject",
+    "GEOIP,CN,DIRECT",
+    "IP-CIDR,10.0.0.0/8,Lan,no-resolve",
+    "IP-CIDR,192.168.0.0/16,Home",
+    "IP-CIDR6,fd00::/8,Lan6,no-resolve",
+    "MATCH,Proxy",
+]
+
+
+@pytest.fixture
+def engine():
+    return RuleEngine(RULES)
+
+
+@pytest.mark.parametrize(
+    "query, target, line",
+    [
+        ("exact.example.com", "Exact", 0),
+        ("EXACT.example.com.", "Exact", 0),
+        ("www.example.com", "Suffix", 1),
+        ("example.com", "Suffix", 1),
+        ("ads.tracker.net", "Reject", 2),
+        ("10.1.2.3", "Lan", 4),
+        ("192.168.1.1", "Home", 5),
+        ("fd12::1", "Lan6", 6),
+        ("other.net", "Proxy", 7),
+        ("8.8.8.8", "Proxy", 7),
+    ],
+)
+def test_match(engine, query, target, line):
+    result = engine.match(query)
+    assert result["matched"] is True
+    assert (result["target"], result["line"]) == (target, line)
+
+
+def test_match_reports_skipped_rules(engine):
+    # GEOIP can not be evaluated offline, domain queries also skip resolving IP rules
+    assert engine.match("10.1.2.3")["skipped"] == ["GEOIP,CN,DIRECT"]
+    assert engine.match("other.net")["skipped"] == [
+        "GEOIP,CN,DIRECT",
+        "IP-CIDR,192.168.0.0/16,Home",
+    ]
+    assert engine.match("www.example.com")["skipped"] == []
+
+
+def test_no_match_without_final():
+    result = RuleEngine(["DOMAIN,a.example.com,A"]).match("b.example.com")
+    assert result["matched"] is False
+    assert "target" not in result
+
+
+def test_match_many(engine):
+    results = engine.match_many(["www.example.com", "10.0.0.1"])
+    assert [result["target"] for result in results] == ["Suffix", "Lan"]
+
+
+def test_rules_without_payload_are_unevaluated():
+    engine = RuleEngine(["GEOIP", "DOMAIN", "DOMAIN-SUFFIX,example.com,A"])
+    result = engine.match("www.example.com")
+    assert result["target"] == "A"
+    assert result["skipped"] == ["GEOIP", "DOMAIN"]
+
+
+def test_audit_shadowed_and_unreachable():
+    engine = RuleEngine(
+        [
+            "DOMAIN-SUFFIX,example.com,A",
+            "DOMAIN,www.example.com,B",
+            "DOMAIN-KEYWORD,ads,C",
+            "DOMAIN-SUFFIX,ads.net,D",
+            "IP-CIDR,10.0.0.0/8,E",
+            "IP-CIDR,10.1.0.0/16,F",
+            "MATCH,G",
+            "DOMAIN,late.example.org,H",
+        ]
+    )
+    audit = engine.audit()
+    assert audit["total"] == 8
+    assert [(entry["rule"], entry["shadowed_by"]) for entry in audit["shadowed"]] == [
+        ("DOMAIN,www.example.com,B", "DOMAIN-SUFFIX,example.com,A"),
+        ("DOMAIN-SUFFIX,ads.net,D", "DOMAIN-KEYWORD,ads,C"),
+        ("IP-CIDR,10.1.0.0/16,F", "IP-CIDR,10.0.0.0/8,E"),
+    ]
+    assert [entry["rule"] for entry in audit["unreachable"]] == [
+        "DOMAIN,late.example.org,H"
+    ]
+
+
+def test_no_resolve_rule_does_not_shadow_resolving_rule():
+    # The later rule still matches domain queries resolving into 10.1.0.0/16
+    engine = RuleEngine(
+        ["IP-CIDR,10.0.0.0/8,DIRECT,no-resolve", "IP-CIDR,10.1.0.0/16,Proxy"]
+    )
+    assert engine.audit()["shadowed"] == []
+
+
+def test_resolving_rule_shadows_no_resolve_rule():
+    engine = RuleEngine(
+        ["IP-CIDR,10.0.0.0/8,DIRECT", "IP-CIDR,10.1.0.0/16,Proxy,no-resolve"]
+    )
+    assert [entry["line"] for entry in engine.audit()["shadowed"]] == [1]
+
+
+def test_rule_set_is_expanded(tmp_path):
+    (tmp_path / "rules").mkdir()
+    (tmp_path / "rules" / "games.yml").write_text(
+        "payload:\n  - DOMAIN-SUFFIX,steamcontent.com\n  - IP-CIDR,162.254.192.0/21\n"
+    )
+    config = tmp_path / "config.yml"
+    config.write_text(
+        "rule-providers:\n"
+        "  games:\n"
+        "    type: file\n"
+        "    behavior: classical\n"
+        "    path: ./rules/games.yml\n"
+        "rules:\n"
+        "  - RULE-SET,games,DIRECT\n"
+        "  - MATCH,Proxy\n"
+    )
+    engine = load_engine(str(config))
+    result = engine.match("cache1.steamcontent.com")
+    assert result["rule"] == "DOMAIN-SUFFIX,steamcontent.com,DIRECT"
+    assert result["line"] == 0
+    assert engine.match("162.254.193.7")["target"] == "DIRECT"
+    assert load_engine(str(config)) is engine
@@ -0,0 +1,166 @@
+import base64
+import json
+import os
+
+import pytest
+
+from py_modules.subconv import convert_subscription, detect_format
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "subconv")
+TEMPLATE = {
+    "proxy-groups": [
+        {"name": "Proxy", "type": "select", "proxies": ["Auto", "DIRECT"]},
+        {"name": "Auto", "type": "url-test", "proxies": []},
+    ],
+    "rules": ["MATCH,Proxy"],
+}
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def convert(name):
+    return convert_subscription(fixture(name), TEMPLATE)
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("clash.yml", "clash"),
+        ("ss_sip002.txt", "uri"),
+        ("ss_legacy.txt", "uri"),
+        ("ss_plugin.txt", "uri"),
+        ("vmess.txt", "uri"),
+        ("trojan.txt", "uri"),
+        ("vless.txt", "uri"),
+        ("plain_list.txt", "uri"),
+        ("base64_list.txt", "base64"),
+    ],
+)
+def test_detect_format(name, expected):
+    assert detect_format(fixture(name)) == expected
+
+
+@pytest.mark.parametrize("text", ["", "hello world\n", "key: value\n", "%%%\n"])
+def test_detect_format_unrecognised(text):
+    assert detect_format(text) is None
+
+
+def test_clash_profile_is_kept():
+    profile, skipped = convert("clash.yml")
+    assert profile["proxies"][0]["name"] == "Clash SS"
+    assert profile["rules"] == ["MATCH,Proxy"]
+    assert skipped == []
+
+
+def test_ss_sip002():
+    profile, _ = convert("ss_sip002.txt")
+    assert profile["proxies"] == [
+        {
+            "name": "SS SIP002",
+            "type": "ss",
+            "server": "ss.example.com",
+            "port": 8388,
+            "cipher": "aes-256-gcm",
+            "password": "secret",
+            "udp": True,
+        }
+    ]
+
+
+def test_ss_legacy():
+    profile, _ = convert("ss_legacy.txt")
+    proxy = profile["proxies"][0]
+    assert proxy["name"] == "SS Legacy"
+    assert (proxy["server"], proxy["port"]) == ("198.51.100.7", 8389)
+    assert (proxy["cipher"], proxy["password"]) == ("chacha20-ietf-poly1305", "secret")
+
+
+def test_ss_plugin():
+    profile, _ = convert("ss_plugin.txt")
+    proxy = profile["proxies"][0]
+    assert proxy["plugin"] == "obfs"
+    assert proxy["plugin-opts"] == {"mode": "tls", "host": "cdn.example.com"}
+
+
+def test_vmess():
+    profile, _ = convert("vmess.txt")
+    proxy = profile["proxies"][0]
+    assert proxy["name"] == "VMess WS"
+    assert (proxy["server"], proxy["port"]) == ("vmess.example.com", 443)
+    assert proxy["uuid"] == "b831381d-6324-4d53-ad4f-8cda48b30811"
+    assert proxy["tls"] is True
+    assert proxy["servername"] == "cdn.example.com"
+    assert proxy["network"] == "ws"
+    assert proxy["ws-opts"] == {"path": "/ray", "headers": {"Host": "cdn.example.com"}}
+
+
+def test_trojan():
+    profile, _ = convert("trojan.txt")
+    proxy = profile["proxies"][0]
+    assert proxy["name"] == "Trojan WS"
+    assert proxy["password"] == "p@ss"
+    assert proxy["sni"] == "trojan.example.com"
+    assert proxy["ws-opts"] == {"path": "/ws", "headers": {"Host": "cdn.example.com"}}
+
+
+def test_vless_only_is_rejected():
+    # Clash Premium can not load vless, a profile without proxies would not start
+    with pytest.raises(ValueError):
+        convert("vless.txt")
+
+
+def test_vless_is_decoded_when_supported():
+    profile, skipped = convert_subscription(
+        fixture("vless.txt"), TEMPLATE, supported_types=("vless",)
+    )
+    proxy = profile["proxies"][0]
+    assert proxy["flow"] == "xtls-rprx-vision"
+    assert proxy["reality-opts"] == {"public-key": "key", "short-id": "ab"}
+    assert skipped == []
+
+
+@pytest.mark.parametrize("name", ["plain_list.txt", "base64_list.txt"])
+def test_uri_list(name):
+    profile, skipped = convert(name)
+    names = ["SS SIP002", "VMess WS", "Trojan WS"]
+    assert [proxy["name"] for proxy in profile["proxies"]] == names
+    assert [line.partition("://")[0] for line in skipped] == ["vless"]
+    groups = {group["name"]: group["proxies"] for group in profile["proxy-groups"]}
+    assert groups["Proxy"] == ["Auto", "DIRECT"] + names
+    assert groups["Auto"] == names
+    assert profile["rules"] == ["MATCH,Proxy"]
+
+
+def test_format_hint_falls_back_to_detection():
+    profile, _ = convert_subscription(
+        fixture("base64_list.txt"), TEMPLATE, subscription_format="clash"
+    )
+    assert len(profile["proxies"]) == 3
+
+
+def test_duplicate_names_are_numbered():
+    profile, _ = convert_subscription(fixture("trojan.txt") * 2, TEMPLATE)
+    assert [proxy["name"] for proxy in profile["proxies"]] == [
+        "Trojan WS",
+        "Trojan WS 2",
+    ]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"add": "a.example.com", "port": None, "id": "id"},
+        ["not", "an", "object"],
+        {"port": "443", "id": "id"},
+    ],
+)
+def test_bad_lines_are_skipped(payload):
+    bad = "vmess://" + base64.b64encode(json.dumps(payload).encode()).decode()
+    profile, skipped = convert_subscription(
+        bad + "\n" + fixture("trojan.txt"), TEMPLATE
+    )
+    assert [proxy["name"] for proxy in profile["proxies"]] == ["Trojan WS"]
+    assert skipped == [bad]